@@ -3,15 +3,73 @@ from tkinter import ttk, messagebox
 import serial
 import serial.tools.list_ports
 import threading
+import queue
 import time
 import struct
+import sys
+from functools import lru_cache
+
+# Format frame dikompilasi sekali saat modul dimuat
+# [Slave ID (1)] + [Function Code (1)] + [Register Address (2)] + [Value (2)], big-endian
+_FRAME_HEADER = struct.Struct('>BBHH')
+# CRC-16 Modbus dikirim low byte dulu
+_CRC = struct.Struct('<H')
+_FRAME_SIZE = _FRAME_HEADER.size + _CRC.size
+
+
+def _build_crc16_table():
+    """Membangun tabel lookup CRC-16 Modbus (polinomial 0xA001)."""
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            if (crc & 1) != 0:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+# Tabel dihitung sekali saat modul dimuat
+_CRC16_TABLE = _build_crc16_table()
+
+
+def _crc16_int(data, _tbl=_CRC16_TABLE):
+    """Menghitung CRC-16 Modbus dari data (bytes-like) dan mengembalikannya sebagai int."""
+    # Tabel diikat sebagai argumen default agar diakses sebagai variabel lokal
+    crc = 0xFFFF
+    for b in data:
+        crc = (crc >> 8) ^ _tbl[(crc ^ b) & 0xFF]
+    return crc
+
+
+@lru_cache(maxsize=256)
+def _build_frame_cached(slave_id, function_code, register_address, value):
+    """Membentuk frame Modbus RTU lengkap (Slave ID + PDU + CRC) sebagai bytes.
+
+    Hasilnya di-cache sehingga nilai yang sering dikirim (mis. setpoint frekuensi
+    yang sama) tidak perlu di-pack dan dihitung CRC-nya lagi.
+    """
+    # Frame dirakit langsung di satu buffer 8 byte:
+    # [Slave ID (1)] + [Function Code (1)] + [Register Address (2)] + [Value (2)] + [CRC (2)]
+    buf = bytearray(_FRAME_SIZE)
+    _FRAME_HEADER.pack_into(buf, 0, slave_id, function_code, register_address, value)
+
+    # CRC dihitung atas 6 byte pertama lalu ditulis (low byte dulu) di offset 6
+    crc = _crc16_int(memoryview(buf)[:6])
+    _CRC.pack_into(buf, 6, crc)
+
+    # Disimpan sebagai bytes (immutable) karena hasilnya dibagikan lewat cache
+    return bytes(buf)
+
 
 class ManualModbusController:
     """
     Kelas untuk mengelola komunikasi Modbus RTU secara manual dengan spindle.
     Menggunakan pyserial untuk komunikasi dan membuat frame Modbus sendiri.
     """
-    def __init__(self, port=None, baudrate=38400, bytesize=8, parity='E', stopbits=1, slave_id=1):
+    def __init__(self, port=None, baudrate=38400, bytesize=8, parity='E', stopbits=1, slave_id=1, expect_echo=True,
+                 turnaround_time=0.1):
         self.ser = None
         self.port = port
         self.baudrate = baudrate
@@ -19,13 +77,24 @@ class ManualModbusController:
         self.parity = parity
         self.stopbits = stopbits
         self.slave_id = slave_id
+        # False: respons slave tidak dibaca/diverifikasi; hanya untuk jalur di mana
+        # balasan slave tidak diterima (bukan bus 2-wire yang balasannya ikut terbaca)
+        self.expect_echo = expect_echo
+        # Waktu tunggu tambahan untuk pemrosesan di drive dan latensi adaptor USB-serial (detik)
+        self.turnaround_time = turnaround_time
         self.is_connected = False
+        self._rebuild_static_frames()
 
     def connect(self):
         """Mencoba untuk membuat koneksi serial."""
         if self.ser and self.ser.is_open:
             self.disconnect()
 
+        # slave_id sudah final saat koneksi dibuat; siapkan ulang frame tetap
+        if not self._rebuild_static_frames():
+            self.is_connected = False
+            return False
+
         try:
             self.ser = serial.Serial(
                 port=self.port,
@@ -36,6 +105,13 @@ class ManualModbusController:
                 timeout=1
             )
             if self.ser.is_open:
+                # Timeout baca: waktu kirim request + balasan (11 bit per karakter)
+                # ditambah waktu turnaround drive dan latensi adaptor
+                self.ser.timeout = 2 * _FRAME_SIZE * self._char_time() + self.turnaround_time
+                # Batas waktu write(); tidak berlaku untuk flush()
+                self.ser.write_timeout = 0.2
+                if sys.platform.startswith('linux'):
+                    self._enable_low_latency()
                 self.is_connected = True
                 return True
             else:
@@ -46,6 +122,22 @@ class ManualModbusController:
             print(f"Error connecting to serial port: {e}")
             return False
 
+    def _char_time(self):
+        """Waktu kirim satu karakter RTU (11 bit) pada baudrate saat ini, dalam detik."""
+        return 11 / self.baudrate
+
+    def _enable_low_latency(self):
+        """Mengaktifkan mode ASYNC_LOW_LATENCY pada driver serial Linux.
+
+        Tanpa mode ini driver tty mengumpulkan data hingga ~16 ms sebelum diteruskan,
+        sehingga pembacaan echo menjadi lambat.
+        """
+        try:
+            self.ser.set_low_latency_mode(True)
+        except (OSError, ValueError) as e:
+            # Tidak semua driver (mis. beberapa adaptor USB) mendukung mode ini
+            print(f"Low latency mode tidak dapat diaktifkan: {e}")
+
     def disconnect(self):
         """Menutup koneksi serial."""
         if self.ser and self.ser.is_open:
@@ -55,52 +147,58 @@ class ManualModbusController:
         return False
 
     @staticmethod
-    def calculate_crc(data: bytes) -> bytes:
+    def calculate_crc(data: bytes, _pack=_CRC.pack) -> bytes:
         """Menghitung checksum CRC-16 untuk data Modbus."""
-        crc = 0xFFFF
-        for pos in data:
-            crc ^= pos
-            for _ in range(8):
-                if (crc & 1) != 0:
-                    crc >>= 1
-                    crc ^= 0xA001
-                else:
-                    crc >>= 1
         # Mengembalikan CRC sebagai 2 byte (low byte, high byte)
-        return struct.pack('<H', crc)
+        return _pack(_crc16_int(data))
 
-    def _send_modbus_rtu_frame(self, function_code, register_address, value):
-        """
-        Membuat dan mengirim frame Modbus RTU lengkap (Fungsi 0x06: Write Single Register).
+    def _build_frame(self, function_code, register_address, value):
+        """Membentuk frame Modbus RTU lengkap untuk slave_id saat ini."""
+        return _build_frame_cached(self.slave_id, function_code, register_address, value)
+
+    def _rebuild_static_frames(self):
+        """Menghitung ulang frame tetap (CW, CCW, Stop) untuk slave_id saat ini.
+
+        Mengembalikan False jika slave_id tidak bisa dikodekan ke dalam frame.
         """
+        # Cache frame tidak perlu dikosongkan: slave_id sudah menjadi bagian dari kunci cache
+        try:
+            self._frame_cw = self._build_frame(0x06, 0x6000, 1)    # Register: 0x6000, Nilai: 1
+            self._frame_ccw = self._build_frame(0x06, 0x6000, 2)   # Register: 0x6000, Nilai: 2
+            self._frame_stop = self._build_frame(0x06, 0x5000, 0)  # Register: 0x5000, Nilai: 0
+        except struct.error as e:
+            self._frame_cw = self._frame_ccw = self._frame_stop = None
+            print(f"Slave ID tidak valid ({self.slave_id}): {e}")
+            return False
+        return True
+
+    def _write_and_verify(self, rtu_frame):
+        """Mengirim frame RTU yang sudah jadi dan memverifikasi gema (echo) dari perangkat."""
         if not self.is_connected:
             return False, "Tidak terhubung ke port serial."
 
         try:
-            # 1. Bentuk PDU (Protocol Data Unit) tanpa Slave ID dan CRC
-            # [Function Code (1 byte)] + [Register Address (2 bytes)] + [Value (2 bytes)]
-            pdu = struct.pack('>BHH', function_code, register_address, value)
-
-            # 2. Tambahkan Slave ID untuk membuat data yang akan di-CRC
-            data_for_crc = struct.pack('B', self.slave_id) + pdu
-
-            # 3. Hitung CRC
-            crc = self.calculate_crc(data_for_crc)
-
-            # 4. Gabungkan semua menjadi frame RTU lengkap
-            rtu_frame = data_for_crc + crc
-
-            # 5. Kirim frame melalui serial
-            self.ser.flushInput()
-            self.ser.flushOutput()
+            # Buang sisa byte lama agar tidak terbaca sebagai echo perintah ini
+            self.ser.reset_input_buffer()
             self.ser.write(rtu_frame)
-
-            # 6. (Opsional tapi direkomendasikan) Baca respons untuk konfirmasi
+            # Tunggu sampai buffer TX benar-benar kosong sebelum mulai menunggu echo.
+            # Di POSIX ini tcdrain() tanpa batas waktu; di Windows pyserial mem-polling
+            # out_waiting dengan sleep 50 ms, sehingga bisa menambah hingga ~50 ms per perintah.
+            self.ser.flush()
+
+            if not self.expect_echo:
+                # Untuk jalur tanpa balasan: cukup jaga jeda antar-frame Modbus RTU
+                # (3.5 karakter) sebelum perintah berikutnya boleh dikirim
+                time.sleep(3.5 * self._char_time())
+                return True, "Perintah berhasil dikirim (respons tidak diverifikasi)."
+
+            # (Opsional tapi direkomendasikan) Baca respons untuk konfirmasi
             # Untuk fungsi 06, respons yang berhasil adalah gema (echo) dari permintaan
             response = self.ser.read(len(rtu_frame))
-            if response == rtu_frame:
+            # Cek panjang dulu: frame terpotong langsung gagal tanpa perbandingan penuh
+            if len(response) == len(rtu_frame) and response == rtu_frame:
                 return True, "Perintah berhasil dikirim dan dikonfirmasi."
-            elif len(response) > 0:
+            if len(response) > 0:
                 return False, f"Respons tidak valid diterima: {response.hex()}"
             else:
                 return False, "Tidak ada respons dari perangkat (timeout)."
@@ -110,20 +208,27 @@ class ManualModbusController:
         except Exception as e:
             return False, f"Error saat mengirim perintah: {e}"
 
+    def _send_modbus_rtu_frame(self, function_code, register_address, value):
+        """
+        Membuat dan mengirim frame Modbus RTU lengkap (Fungsi 0x06: Write Single Register).
+        """
+        try:
+            rtu_frame = self._build_frame(function_code, register_address, value)
+        except Exception as e:
+            return False, f"Error saat mengirim perintah: {e}"
+        return self._write_and_verify(rtu_frame)
+
     def start_cw(self):
         """Mengirim perintah untuk memutar spindle searah jarum jam (CW)."""
-        # Register: 0x6000, Nilai: 1
-        return self._send_modbus_rtu_frame(0x06, 0x6000, 1)
+        return self._write_and_verify(self._frame_cw)
 
     def start_ccw(self):
         """Mengirim perintah untuk memutar spindle berlawanan arah jarum jam (CCW)."""
-        # Register: 0x6000, Nilai: 2
-        return self._send_modbus_rtu_frame(0x06, 0x6000, 2)
+        return self._write_and_verify(self._frame_ccw)
 
     def stop_spindle(self):
         """Mengirim perintah untuk menghentikan spindle (mengatur frekuensi ke 0)."""
-        # Register: 0x5000, Nilai: 0
-        return self._send_modbus_rtu_frame(0x06, 0x5000, 0)
+        return self._write_and_verify(self._frame_stop)
 
     def set_frequency(self, frequency_value):
         """Mengirim perintah untuk mengatur frekuensi spindle."""
@@ -137,13 +242,27 @@ class SpindleGUI:
     """
     Kelas untuk membuat antarmuka pengguna grafis (GUI) untuk mengontrol spindle.
     """
+    _PARITY_MAP = {'None': 'N', 'Even': 'E', 'Odd': 'O', 'Mark': 'M', 'Space': 'S'}
+    _VALID_STOPBITS = frozenset((1, 1.5, 2))
+
     def __init__(self, master):
         self.master = master
         master.title("Kontrol Spindle Modbus (Manual)")
-        master.geometry("400x500") # Menyesuaikan tinggi jendela untuk field baru
+        master.geometry("400x530") # Menyesuaikan tinggi jendela untuk field baru
         master.resizable(False, False)
 
         self.controller = ManualModbusController()
+
+        # Antrian perintah serial, dikerjakan oleh satu thread worker agar GUI tidak tertahan
+        self._cmd_q = queue.Queue()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+        # Setpoint frekuensi terbaru yang belum dikirim (debounce 20 ms)
+        self._pending_freq = None
+        self._freq_after_id = None
+
+        self.available_ports = []
+        self._port_scan_running = False
         self.create_widgets()
         self.update_port_list()
 
@@ -157,6 +276,9 @@ class SpindleGUI:
         self.port_combobox = ttk.Combobox(connection_frame, width=20, state="readonly")
         self.port_combobox.grid(row=0, column=1, padx=5, pady=2, sticky="ew")
         self.port_combobox.bind("<<ComboboxSelected>>", self.on_port_selected)
+        # Pindai ulang port secara eksplisit (mis. setelah adaptor USB baru dicolokkan)
+        self.refresh_ports_button = ttk.Button(connection_frame, text="Segarkan", width=8, command=self.update_port_list)
+        self.refresh_ports_button.grid(row=0, column=2, padx=5, pady=2, sticky="ew")
 
         ttk.Label(connection_frame, text="Baud Rate:").grid(row=1, column=0, padx=5, pady=2, sticky="w")
         self.baudrate_entry = ttk.Entry(connection_frame, width=20)
@@ -178,6 +300,10 @@ class SpindleGUI:
         self.stopbits_combobox = ttk.Combobox(connection_frame, width=20, values=[1, 1.5, 2], state="readonly")
         self.stopbits_combobox.set(1)
         self.stopbits_combobox.grid(row=4, column=1, padx=5, pady=2, sticky="ew")
+
+        self.expect_echo_var = tk.BooleanVar(value=True)
+        self.expect_echo_checkbutton = ttk.Checkbutton(connection_frame, text="Baca respons slave (verifikasi perintah)", variable=self.expect_echo_var)
+        self.expect_echo_checkbutton.grid(row=5, column=0, columnspan=2, padx=5, pady=2, sticky="w")
         # --- AKHIR WIDGET BARU ---
 
         self.connect_button = ttk.Button(connection_frame, text="Hubungkan", command=self.connect_modbus)
@@ -211,11 +337,31 @@ class SpindleGUI:
         self.status_label.pack(side=tk.BOTTOM, fill="x")
 
     def update_port_list(self):
-        """Memperbarui daftar port serial yang tersedia."""
-        ports = serial.tools.list_ports.comports()
-        self.available_ports = [port.device for port in ports]
+        """Memperbarui daftar port serial yang tersedia (enumerasi di thread terpisah)."""
+        if self._port_scan_running:
+            return
+        self._port_scan_running = True
+        threading.Thread(target=self._enum_ports_bg, daemon=True).start()
+
+    def _enum_ports_bg(self):
+        """Enumerasi port serial di background; bisa lambat di Windows."""
+        try:
+            ports = [port.device for port in serial.tools.list_ports.comports()]
+        except Exception:
+            ports = []
+        # Pembaruan combobox dijadwalkan di main thread tkinter
+        self.master.after(0, self._apply_port_list, ports)
+
+    def _apply_port_list(self, ports):
+        """Mengisi combobox dengan hasil enumerasi port."""
+        self._port_scan_running = False
+        self.available_ports = ports
         self.port_combobox['values'] = self.available_ports
-        if self.available_ports:
+        current = self.port_combobox.get()
+        if current in self.available_ports:
+            # Pertahankan pilihan pengguna jika port masih tersedia
+            self.controller.port = current
+        elif self.available_ports:
             self.port_combobox.set(self.available_ports[0])
             self.controller.port = self.available_ports[0]
         else:
@@ -237,8 +383,6 @@ class SpindleGUI:
         # --- MEMBACA NILAI DARI WIDGET BARU ---
         parity_str = self.parity_combobox.get()
         stopbits_str = self.stopbits_combobox.get()
-        
-        parity_map = {'None': 'N', 'Even': 'E', 'Odd': 'O', 'Mark': 'M', 'Space': 'S'}
 
         if not port or port == "Tidak ada port":
             messagebox.showerror("Error Koneksi", "Pilih port serial yang valid.")
@@ -252,22 +396,28 @@ class SpindleGUI:
             messagebox.showerror("Error Input", "Baud Rate, Slave ID, dan Stop Bits harus berupa angka yang valid.")
             return
 
-        if parity_str not in parity_map:
+        if parity_str not in self._PARITY_MAP:
             messagebox.showerror("Error Input", "Nilai Parity tidak valid.")
             return
         
-        parity = parity_map[parity_str]
+        parity = self._PARITY_MAP[parity_str]
 
-        if stopbits not in [1, 1.5, 2]:
+        if stopbits not in self._VALID_STOPBITS:
              messagebox.showerror("Error Input", "Nilai Stop Bits tidak valid.")
              return
 
+        # Alamat slave Modbus yang valid adalah 1-247
+        if not 1 <= slave_id <= 247:
+            messagebox.showerror("Error Input", "Slave ID harus di antara 1 dan 247.")
+            return
+
         # --- MEMPERBARUI PENGATURAN CONTROLLER ---
         self.controller.port = port
         self.controller.baudrate = baudrate
         self.controller.parity = parity
         self.controller.stopbits = stopbits
         self.controller.slave_id = slave_id
+        self.controller.expect_echo = self.expect_echo_var.get()
 
         self.update_status("Mencoba menghubungkan...", "orange")
         threading.Thread(target=self._connect_modbus_thread, daemon=True).start()
@@ -287,24 +437,49 @@ class SpindleGUI:
     def disconnect_modbus(self):
         """Menangani tombol 'Putuskan'."""
         self.update_status("Memutuskan koneksi...", "orange")
+        self._cancel_pending_freq()
+        # Port ditutup lewat antrian agar tidak ditutup saat worker sedang memakai serial
+        self._cmd_q.put((self._disconnect_op, (), self._on_disconnect_done))
+
+    def _disconnect_op(self):
+        """Menutup koneksi serial; dijalankan di thread worker."""
         if self.controller.disconnect():
-            self.update_status("Koneksi terputus.", "red")
+            return True, "Koneksi terputus."
+        return False, "Tidak ada koneksi aktif untuk diputuskan."
+
+    def _on_disconnect_done(self, success, message):
+        """Memperbarui GUI setelah koneksi ditutup oleh worker."""
+        self.update_status(message, "red")
+        if success:
             self.set_connection_widgets_state(tk.NORMAL)
             self.set_control_state(tk.DISABLED)
-        else:
-            self.update_status("Tidak ada koneksi aktif untuk diputuskan.", "red")
+
+    def _worker(self):
+        """Thread worker yang menjalankan perintah serial dari antrian satu per satu."""
+        while True:
+            op, args, cb = self._cmd_q.get()
+            try:
+                success, message = op(*args)
+            except Exception as e:
+                success, message = False, f"Error saat mengirim perintah: {e}"
+            # Hasil dikembalikan ke main thread tkinter
+            self.master.after(0, cb, success, message)
+
+    def _enqueue_command(self, op, args, label):
+        """Memasukkan perintah controller ke antrian; status diperbarui saat selesai."""
+        def _done(success, message):
+            self.update_status(f"{label}: {message}", "green" if success else "red")
+        self._cmd_q.put((op, args, _done))
 
     def on_cw_click(self):
         """Menangani tombol 'CW'."""
         self.update_status("Mengirim perintah CW...", "blue")
-        success, message = self.controller.start_cw()
-        self.update_status(f"CW: {message}", "green" if success else "red")
+        self._enqueue_command(self.controller.start_cw, (), "CW")
 
     def on_ccw_click(self):
         """Menangani tombol 'CCW'."""
         self.update_status("Mengirim perintah CCW...", "blue")
-        success, message = self.controller.start_ccw()
-        self.update_status(f"CCW: {message}", "green" if success else "red")
+        self._enqueue_command(self.controller.start_ccw, (), "CCW")
 
     def on_set_frequency_click(self):
         """Menangani tombol 'Atur Frekuensi'."""
@@ -314,17 +489,34 @@ class SpindleGUI:
             if frequency < 0:
                 raise ValueError("Frekuensi tidak boleh negatif.")
             self.update_status(f"Mengirim frekuensi: {frequency}...", "blue")
-            success, message = self.controller.set_frequency(frequency)
-            self.update_status(f"Set Frekuensi: {message}", "green" if success else "red")
+            # Hanya nilai terakhir yang dikirim; nilai sebelumnya yang belum terkirim dibuang
+            self._pending_freq = frequency
+            if self._freq_after_id is None:
+                self._freq_after_id = self.master.after(20, self._flush_freq)
         except ValueError:
             messagebox.showerror("Error Input", "Frekuensi harus berupa bilangan bulat positif.")
             self.update_status("Input frekuensi tidak valid.", "red")
 
+    def _flush_freq(self):
+        """Mengirim setpoint frekuensi terbaru yang tertunda ke antrian perintah."""
+        self._freq_after_id = None
+        frequency, self._pending_freq = self._pending_freq, None
+        if frequency is not None:
+            self._enqueue_command(self.controller.set_frequency, (frequency,), "Set Frekuensi")
+
+    def _cancel_pending_freq(self):
+        """Membatalkan setpoint frekuensi yang belum sempat dikirim."""
+        if self._freq_after_id is not None:
+            self.master.after_cancel(self._freq_after_id)
+            self._freq_after_id = None
+        self._pending_freq = None
+
     def on_stop_click(self):
         """Menangani tombol 'Hentikan Spindle'."""
+        # Jangan sampai frekuensi tertunda terkirim setelah perintah stop
+        self._cancel_pending_freq()
         self.update_status("Mengirim perintah Hentikan Spindle (Frekuensi 0)...", "blue")
-        success, message = self.controller.stop_spindle()
-        self.update_status(f"Hentikan Spindle: {message}", "green" if success else "red")
+        self._enqueue_command(self.controller.stop_spindle, (), "Hentikan Spindle")
         self.frequency_entry.delete(0, tk.END)
         self.frequency_entry.insert(0, "0")
 
@@ -348,6 +540,8 @@ class SpindleGUI:
         self.slave_id_entry.config(state=entry_state)
         self.parity_combobox.config(state=widget_state)
         self.stopbits_combobox.config(state=widget_state)
+        self.expect_echo_checkbutton.config(state=entry_state)
+        self.refresh_ports_button.config(state=entry_state)
         
         self.connect_button.config(state=state)
         self.disconnect_button.config(state=tk.NORMAL if state == tk.DISABLED else tk.DISABLED)